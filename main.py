@@ -1,71 +1,378 @@
-import requests
 import json
 import os
 import sys
-import traceback
-import ollama
 import dotenv
 import subprocess
-import html5lib
 import re
+import ast
+import hashlib
+import math
+import time
+import threading
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+from types import MappingProxyType
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
 dotenv.load_dotenv()  # Load environment variables
 PROJECT_PLANNER_MODEL = os.getenv("PROJECT_PLANNER_MODEL", "dolphin-mistral:latest")
 CODER_MODEL = os.getenv("CODER_MODEL", "codellama:7b")
-MARKDOWN_MAKER = os.getenv("CODER_MODEL", "vicuna:13b-16k")
+CORRECTION_MODEL = os.getenv("CORRECTION_MODEL", CODER_MODEL)  # Optionally a larger model, only used to fix failing code
+MARKDOWN_MAKER = os.getenv("MARKDOWN_MAKER", CODER_MODEL)  # Shares the coder model unless set, so one model less has to be loaded
 TASKNAMER = os.getenv("TASKNAMER", "stablelm2:1.6b-zephyr-fp16")
+CACHE_ENABLED = os.getenv("AIRO_CACHE", "1") != "0"  # AIRO_CACHE=0 always asks the models
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+PROMPT_VERSION = "1"  # Bump whenever prompt templates change to invalidate cached responses
+CACHE_DIR = os.path.expanduser(os.getenv("CACHE_DIR", "~/.airo/cache"))  # Persistent response cache shared across runs
+SEMANTIC_CACHE_DIR = os.path.join(CACHE_DIR, "semantic")  # Embeddings and answers of the semantic cache
+CACHE_TTL = int(os.getenv("CACHE_TTL", str(7 * 24 * 60 * 60)))  # Seconds before a persisted response expires
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "")  # e.g. nomic-embed-text; empty disables the semantic cache
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_AGENTS = ('project_planner', 'markdown')  # Free-text agents only; code must match exactly
+MAX_PARALLEL_TASKS = int(os.getenv("MAX_PARALLEL_TASKS", "4"))  # Concurrent coder requests sent to Ollama
+MAX_TEST_ITERATIONS = int(os.getenv("MAX_TEST_ITERATIONS", "5"))  # Test runs per snippet, each failed run triggers one correction
+OLLAMA_HOST = os.getenv("OLLAMA_HOST")  # None lets the ollama client use its default (http://localhost:11434)
+KEEP_ALIVE = os.getenv("KEEP_ALIVE", "30m")  # How long Ollama keeps a model loaded after a request
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "1") != "0"  # Load the models while the user is still typing
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "0")) or None  # Seconds per request; 0 waits indefinitely
+TEST_TIMEOUT = int(os.getenv("TEST_TIMEOUT", "30"))  # Seconds a generated Python script may run during testing
+STATIC_PYTHON_CHECK = os.getenv("STATIC_PYTHON_CHECK", "0") == "1"  # Only compile generated Python, never run it
+PIP_INSTALL = [sys.executable, "-m", "pip", "install", "--disable-pip-version-check", "--no-input", "-q"]
+ERROR_CONTEXT_LINES = 40  # Trailing lines of an error output passed on to the correction model
+
+EXTENSION_TO_LANGUAGE = MappingProxyType({
+    '.py': 'python',
+    '.js': 'javascript',
+    '.html': 'html'
+})
+
+# Import names whose PyPI distribution is called differently
+IMPORT_TO_PACKAGE = MappingProxyType({
+    'cv2': 'opencv-python',
+    'PIL': 'Pillow',
+    'sklearn': 'scikit-learn',
+    'yaml': 'PyYAML',
+    'bs4': 'beautifulsoup4',
+})
+
+SKIPPED_DIRECTORIES = {'.git', 'node_modules', '__pycache__', '.venv', 'venv'}
+
+FILENAME_PATTERN = re.compile(r'\S+?(\.html|\.css|\.js|\.py)\b')
+BACKTICK_FILENAME_PATTERN = re.compile(r'`([^`\s]+?\.(?:html|css|js|py))`')
+FRAMEWORK_NAME_PATTERN = re.compile(r'[A-Z]\w*\.js')  # Node.js, Vue.js, Express.js, ... are no filenames
+INVALID_FILENAME_CHARS = re.compile(r'[<>:"/\\|?*]')
+SLUG_INVALID_CHARS = re.compile(r'[^\w\s]|_')  # Everything but letters, digits and whitespace
+WHITESPACE_PATTERN = re.compile(r'\s+')
+SLUG_MAX_LENGTH = 60  # Characters; keeps folder names well below the 255 byte limit of most file systems
+# Start of a task in a task list without '---' marker: a Markdown heading or a top-level numbered item
+TASK_START_PATTERN = re.compile(r'^(?:(?P<heading>#{2,6}[ \t])|\d+\.[ \t])', re.MULTILINE)
+CODE_BLOCK_PATTERN = re.compile(r'```(?P<tag>[^\n]*)\n(?P<code>.*?)```', re.DOTALL)
+PYTHON_CODE_TAGS = ('python', 'py', 'python3')
+
+AGENT_MODELS = {
+    'project_planner': PROJECT_PLANNER_MODEL,
+    'coder': CODER_MODEL,
+    'correction': CORRECTION_MODEL,
+    'markdown': MARKDOWN_MAKER,
+    'taskname': TASKNAMER,
+}
+
+# Order in which the pipeline first needs each agent: questions and plan, task list, filenames, code, fixes
+PRELOAD_ORDER = ('project_planner', 'markdown', 'taskname', 'coder', 'correction')
+
+# Static per-agent instructions, sent as a byte-identical system message on every call so
+# Ollama can reuse the already evaluated prompt prefix instead of re-processing it.
+SYSTEM_PROMPTS = {
+    'project_planner': "You are an experienced software project planner. You ask precise questions and write detailed, well-structured project descriptions and plans.",
+    'coder': "You are an expert software developer. You write complete, working and well-commented code.",
+    'correction': "You are an expert software developer. You fix bugs in existing code with minimal, precise changes.",
+    'markdown': "You turn software project plans into precise, file-sized coding tasks formatted in Markdown.",
+    'taskname': "You choose short, conventional filenames for source code files. Reply with the filename only, no explanation.",
+}
+# Per-agent Ollama options; the tasknamer only has to produce a single filename
+AGENT_OPTIONS = {
+    'taskname': {'num_predict': 32},
+}
+
+_response_cache = OrderedDict()
+_semantic_cache = []  # (namespace, embedding, norm, response), oldest first
+_semantic_cache_loaded = False  # Persisted entries are read on the first semantic lookup
+_cache_lock = threading.Lock()  # generate_answers is called from worker threads
+_reserved_filenames = set()
+_filename_lock = threading.Lock()
+_html_parsers = threading.local()  # One HTML parser per testing thread
 
 project_name_ui = input("Give this project a unique name: ")
 
-def generate_answers(agent, prompt):
-    model_name = ""
-    if agent == 'project_planner':
-        model_name = PROJECT_PLANNER_MODEL
-    elif agent == 'coder':
-        model_name = CODER_MODEL
-    elif agent == 'markdown':
-        model_name = MARKDOWN_MAKER
-    elif agent == 'taskname':
-        model_name = TASKNAMER
+def cache_key(model_name, system_prompt, prompt):
+    """
+    Builds a deterministic cache key for a (model, system prompt, prompt) triple.
+    The prompt is hashed verbatim; prompts embed source code, where whitespace matters.
+    """
+    return hashlib.sha256(f"{PROMPT_VERSION}\x00{model_name}\x00{system_prompt}\x00{prompt}".encode('utf-8')).hexdigest()
+
+def read_cache_entry(path):
+    """
+    Returns the persisted cache entry stored at path, or None if it is missing, damaged or expired.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or not isinstance(entry.get('created_at'), (int, float)) \
+            or time.time() - entry['created_at'] > CACHE_TTL:
+        try:
+            os.remove(path)  # Drop the expired or damaged entry
+        except OSError:
+            pass
+        return None
+    return entry
+
+def write_cache_entry(directory, key, entry):
+    """
+    Persists a cache entry as <key>.json in directory. The file is written to a temporary name
+    first and then moved into place, so concurrent readers never see partial entries.
+    """
+    path = os.path.join(directory, f"{key}.json")
+    temp_path = None
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')  # Unique across threads and processes
+        with open(fd, 'w', encoding='utf-8') as f:
+            json.dump({**entry, 'created_at': time.time()}, f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Could not write to the response cache: {e}")
+        if temp_path:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+def read_cached_response(key):
+    """
+    Returns a persisted response for the cache key, or None if it is missing or expired.
+    """
+    entry = read_cache_entry(os.path.join(CACHE_DIR, f"{key}.json"))
+    if entry is None:
+        return None
+    return entry.get('response') or None  # Empty answers are never a hit
+
+def write_cached_response(key, model_name, response):
+    """
+    Persists a response under its cache key.
+    """
+    write_cache_entry(CACHE_DIR, key, {'model': model_name, 'response': response})
+
+def lookup_cached_response(key):
+    """
+    Returns the cached response for the key from memory or, failing that, from disk.
+    """
+    with _cache_lock:
+        cached = _response_cache.get(key)
+        if cached is not None:
+            _response_cache.move_to_end(key)
+            return cached
+    cached = read_cached_response(key)
+    if cached is not None:
+        remember_response(key, cached)
+    return cached
+
+def remember_response(key, content):
+    """
+    Stores a response in the in-memory LRU cache.
+    """
+    with _cache_lock:
+        _response_cache[key] = content
+        _response_cache.move_to_end(key)
+        if len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)  # Evict the least recently used response
+
+@lru_cache(maxsize=None)
+def get_ollama_client():
+    """
+    Returns the shared Ollama client. All requests go through this one instance,
+    so its HTTP connection pool keeps the sockets to the server open between calls.
+    """
+    import ollama  # Imported on first use; it pulls in httpx and pydantic
+    return ollama.Client(host=OLLAMA_HOST, timeout=OLLAMA_TIMEOUT)
+
+def embed_text(text):
+    """
+    Returns the embedding vector for a text with normalized whitespace, or None if embeddings are unavailable.
+    """
+    try:
+        return get_ollama_client().embeddings(model=EMBEDDING_MODEL, prompt=' '.join(text.split()), keep_alive=KEEP_ALIVE)['embedding']
+    except Exception as e:
+        print(f"There was an error creating an embedding: {e}")
+        return None
+
+def load_semantic_cache():
+    """
+    Reads the persisted semantic cache entries into memory, once per process, so answers from
+    earlier runs can be reused. Expired and damaged entries are skipped. Call with _cache_lock held.
+    """
+    global _semantic_cache_loaded
+    if _semantic_cache_loaded:
+        return
+    _semantic_cache_loaded = True
+    try:
+        names = os.listdir(SEMANTIC_CACHE_DIR)
+    except OSError:
+        return
+    entries = []
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        entry = read_cache_entry(os.path.join(SEMANTIC_CACHE_DIR, name))
+        if entry is None:
+            continue
+        try:
+            namespace, embedding, response = tuple(entry['namespace']), entry['embedding'], entry['response']
+            norm = math.sqrt(sum(x * x for x in embedding))
+        except (KeyError, TypeError):
+            continue
+        if norm and response:
+            entries.append((entry['created_at'], (namespace, embedding, norm, response)))
+    entries.sort(key=lambda item: item[0])
+    _semantic_cache.extend(cached for _, cached in entries[-RESPONSE_CACHE_SIZE:])
+
+def remember_semantic_response(namespace, text, embedding, content):
+    """
+    Stores an answer in the semantic cache, in memory and in SEMANTIC_CACHE_DIR.
+    """
+    norm = math.sqrt(sum(x * x for x in embedding))
+    if not norm:
+        return
+    with _cache_lock:
+        _semantic_cache.append((namespace, embedding, norm, content))
+        if len(_semantic_cache) > RESPONSE_CACHE_SIZE:
+            _semantic_cache.pop(0)
+    key = hashlib.sha256("\x00".join(map(str, (*namespace, text))).encode('utf-8')).hexdigest()
+    write_cache_entry(SEMANTIC_CACHE_DIR, key, {'namespace': namespace, 'embedding': embedding, 'response': content})
+
+def semantic_lookup(namespace, embedding):
+    """
+    Returns the cached response whose prompt is most similar to the given embedding,
+    provided the cosine similarity reaches SEMANTIC_CACHE_THRESHOLD.
+    """
+    norm = math.sqrt(sum(x * x for x in embedding))
+    if not norm:
+        return None
+    best_score, best_response = 0.0, None
+    for cached_namespace, cached_embedding, cached_norm, cached_response in _semantic_cache:
+        if cached_namespace != namespace:
+            continue
+        score = sum(x * y for x, y in zip(embedding, cached_embedding)) / (norm * cached_norm)
+        if score > best_score:
+            best_score, best_response = score, cached_response
+    return best_response if best_score >= SEMANTIC_CACHE_THRESHOLD else None
+
+def preload_models():
+    """
+    Loads every configured model into Ollama, in the order the agents need them, so the
+    first request of each agent doesn't wait for its model to be loaded.
+    """
+    for model_name in dict.fromkeys(AGENT_MODELS[agent] for agent in PRELOAD_ORDER):  # Each model only once
+        try:
+            get_ollama_client().generate(model=model_name, prompt='', keep_alive=KEEP_ALIVE)  # An empty prompt only loads the model
+        except Exception as e:
+            print(f"Could not preload model {model_name}: {e}")
+
+def get_model_name(agent):
+    """
+    Returns the Ollama model configured for the given agent.
+    """
+    model_name = AGENT_MODELS.get(agent)
     if not model_name:
         raise ValueError("Model name is not specified in the environment variables or defaults are missing.")
+    return model_name
+
+def stream_answers(agent, prompt, template=None, subject=None):
+    """
+    Yields the model's answer in chunks as soon as Ollama produces them, so callers can
+    start working before generation has finished. Cached answers are yielded as one chunk.
+    The answer is only cached once the stream has been consumed completely.
+    template names the prompt template the prompt was built from and subject is the variable text
+    inserted into it. Only calls that pass both use the semantic cache, which compares embeddings
+    of the subject alone and only reuses answers to the same template.
+    """
+    model_name = get_model_name(agent)
+    system_prompt = SYSTEM_PROMPTS.get(agent, '')
+    key = cache_key(model_name, system_prompt, prompt)
+    cached = lookup_cached_response(key) if CACHE_ENABLED else None
+    if cached is not None:
+        yield cached
+        return
+    embedding = None
+    # Embeddings are only comparable within one embedding model and prompt version
+    namespace = (PROMPT_VERSION, EMBEDDING_MODEL, model_name, agent, template)
+    if CACHE_ENABLED and EMBEDDING_MODEL and template and subject and agent in SEMANTIC_CACHE_AGENTS:
+        # The fixed template text would make different subjects look similar, so only the subject is embedded
+        embedding = embed_text(subject)
+        if embedding:
+            with _cache_lock:
+                load_semantic_cache()
+                cached = semantic_lookup(namespace, embedding)
+            if cached is not None:
+                yield cached
+                return
     messages = [
+        {
+            'role': 'system',
+            'content': system_prompt,
+        },
         {
             'role': 'user',
             'content': prompt,
         },
     ]
+    parts = []
+    for chunk in get_ollama_client().chat(model=model_name, messages=messages, options=AGENT_OPTIONS.get(agent),
+                                           keep_alive=KEEP_ALIVE, stream=True):
+        content = chunk['message']['content']
+        parts.append(content)
+        yield content
+    content = ''.join(parts)
+    if not CACHE_ENABLED or not content:
+        return  # An empty answer is a failed generation, not something to repeat for CACHE_TTL
+    remember_response(key, content)
+    write_cached_response(key, model_name, content)
+    if embedding:
+        remember_semantic_response(namespace, subject, embedding, content)
+
+def generate_answers(agent, prompt, template=None, subject=None):
+    get_model_name(agent)  # Fail loudly on a misconfigured agent before talking to Ollama
     try:
-        response = ollama.chat(model=model_name, messages=messages)
-        return response['message']['content']
+        return ''.join(stream_answers(agent, prompt, template, subject))
     except Exception as e:
         print(f"There was an error communicating with the Ollama model: {e}")
         return None
 
 def service_desk(input):
-    response = generate_answers("project_planner", f"Pose meaningful questions for the following project, enabling a very detailed project description to be created: {input}")
+    response = generate_answers("project_planner", f"Pose meaningful questions for the following project, enabling a very detailed project description to be created: {input}",
+                                template="questions", subject=input)
     return response
 
 def service_desk2(answered_questions):
+    # No semantic cache here: every refinement round differs from the last only by the user's newest answer
     complete_project = generate_answers("project_planner", f"Create a detailed project description for the following: {answered_questions}")
     return complete_project
 
 def project_planner(proj):
     project = f"Create a detailed programming plan project task list for the following coding project: {proj}"
-    response = generate_answers("project_planner", project)
+    response = generate_answers("project_planner", project, template="plan", subject=proj)
     return manager(response)
 
 def get_language_from_extension(file_name):
     """
     Determines the programming language based on the file extension.
     """
-    extension_to_language = {
-        '.py': 'python',
-        '.js': 'javascript',
-        '.html': 'html'
-    }
     extension = os.path.splitext(file_name)[1]  # Extract the file extension
-    return extension_to_language.get(extension, 'Unknown')  # Default to 'Unknown'
+    return EXTENSION_TO_LANGUAGE.get(extension, 'Unknown')  # Default to 'Unknown'
 
 def manager(project_plan):
     """
@@ -74,43 +381,32 @@ def manager(project_plan):
     The tasks are then extracted into a list.
     """
     prompt = f"Please divide the following project into a list of precise tasks with specific coding instructions. for building the application. one task is one file. Start the task listing with '---'. Ensure that each task is listed in Markdown format. Here's the project plan: {project_plan}"
-    tasks_response = generate_answers("markdown", prompt)
+    tasks_response = generate_answers("markdown", prompt, template="tasks", subject=project_plan) or ''  # Ensure it's not None
     print(tasks_response)  # For debugging
     
     # Check if '---' is present in the response, to split tasks accordingly
     tasks = []
     if '---' in tasks_response:
-        tasks_section = tasks_response.split('---')[1].strip()
-        tasks = [task for task in tasks_section.split('\n') if task.strip()]
+        tasks_section = tasks_response.partition('---')[2].partition('---')[0]  # Text between the first two markers
+        # Skip blank and markup-only lines (e.g. a lone '-' or '**'); each one would cost a coder call
+        tasks = [task for task in tasks_section.splitlines() if task.strip().strip('-*#').strip()]
     else:
-        if "##" in tasks_response:
-            tasks_section = tasks_response.split("##")[1].strip()
-            tasks = ['### ' + task for task in tasks_section.split('\n### ') if task.strip()]
-        else:
-            if "1." in tasks_response:
-                tasks_section = tasks_response.split("1.")[1].strip()
-                tasks = [f'{i+1}. ' + task for i, task in enumerate(tasks_section.split(f'\n{i}. ')) if task.strip()]
-            else:
-                print("Error: Expected markers not found in the response.")
-        
+        tasks = split_tasks(tasks_response)
+        if not tasks:
+            print("Error: Expected markers not found in the response.")
 
     print(tasks)  # For debugging
    
     # Generate file structure based on tasks
     generate_file_structure(tasks)
    
-    # Call a coder instance for each task
-    code_snippets = []
-    for task in tasks:
-        filename, code_snippet = coder_instance(task)
-        code_snippets.append((filename, code_snippet))
-    
-    # Test    
+    # Call a coder instance for each task and test the results; both stages wait on Ollama
+    # and subprocesses, so they run concurrently
     tested_code_snippets = []
-    for file_name, code_snippet in code_snippets:
-        language = get_language_from_extension(file_name)  # Dynamically detect the language
-        success, tested_code = testing(code_snippet, [], language)  # Provide test cases if needed
-        tested_code_snippets.append((file_name, tested_code))
+    if tasks:
+        with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_TASKS, len(tasks))) as executor:
+            code_snippets = [snippet for snippet in executor.map(coder_instance, tasks) if snippet]
+            tested_code_snippets = list(executor.map(test_snippet, code_snippets))
    
     # Generate documentation
     documentation(tested_code_snippets)
@@ -118,86 +414,226 @@ def manager(project_plan):
     # Install dependencies
     install_dependencies()
 
-def generate_filename(task):
+def split_tasks(tasks_response):
+    """
+    Splits a task list without '---' marker into tasks in a single pass. Tasks start at Markdown headings;
+    if there are none, at top-level numbered items. Each task keeps its marker and the lines below it.
+    Headings without any text below them (e.g. a "## Tasks" title) are skipped, unless no heading has a body.
     """
-    Generates a suitable filename for a given task. Assumes generate_answers 
-    simulates the function call to an external system.
+    starts = list(TASK_START_PATTERN.finditer(tasks_response))
+    headings = [match for match in starts if match.group('heading')]
+    if headings:
+        starts = headings  # Numbered items inside a heading belong to that task
+    ends = [match.start() for match in starts[1:]] + [len(tasks_response)]
+    tasks = [tasks_response[match.start():end].strip() for match, end in zip(starts, ends)]
+    tasks = [task for task in tasks if task]
+    if headings:
+        tasks_with_body = [task for task in tasks if '\n' in task]
+        tasks = tasks_with_body or tasks
+    return tasks
+
+def find_filename(text):
     """
-    # Simuliere eine Antwort von einem externen System
-    # In einer realen Anwendung würde hier generate_answers('taskname', f'create a suitable filename for this code task: {task}') aufgerufen
-    response = generate_answers('taskname', f'create a suitable filename for this code task: {task}')
-    # Suche nach Dateiendungen in der Antwort
-    match = re.search(r'\S+?(\.html|\.css|\.js|\.py)\b', response)
+    Returns the filename named in a text, or None. A name in backticks wins; otherwise the first
+    name in the text is used, skipping capitalised framework names such as "Node.js".
+    """
+    match = BACKTICK_FILENAME_PATTERN.search(text)
     if match:
-        # Extrahiere den Dateinamen aus der Antwort, aber entferne ungültige Zeichen, die in Dateinamen nicht erlaubt sind
-        filename = re.sub(r'[<>:"/\\|?*]', '', match.group(0))
+        return match.group(1)
+    for match in FILENAME_PATTERN.finditer(text):
+        # Markdown-Auszeichnungen vor dem Namen entfernen
+        name = match.group(0).lstrip("`'([*\"")
+        if not FRAMEWORK_NAME_PATTERN.fullmatch(name):
+            return name
+    return None
+
+def generate_filename(task):
+    """
+    Generates a suitable filename for a given task. If the task already names its file
+    (e.g. "### index.html"), that name is used directly; the tasknamer model is only
+    asked when no filename can be read from the task itself.
+    """
+    filename = find_filename(task)
+    if not filename:
+        response = generate_answers('taskname', f'Reply with only a suitable filename for this code task: {task}')
+        # Suche nach Dateiendungen in der Antwort
+        filename = find_filename(response or '')
+    if filename:
+        # Entferne ungültige Zeichen aus dem Dateinamen
+        filename = INVALID_FILENAME_CHARS.sub('', filename)
     else:
         # Verwende einen Standardnamen, wenn keine Dateiendung gefunden wird
-        sanitized_task = re.sub(r'[<>:"/\\|?*]', '', task)  # Entferne ungültige Zeichen
-        filename = sanitized_task.replace(" ", "_").lower() + ".txt"
+        filename = (slugify(task) or "task") + ".txt"  # Ohne ungültige Zeichen, Zeilenumbrüche und in der Länge begrenzt
     return filename
 
+def reserve_filename(filename):
+    """
+    Claims a filename for one coder instance. Coder instances run in parallel, so two tasks
+    that are given the same name get "name_2.ext", "name_3.ext", ... instead of writing into one file.
+    """
+    stem, extension = os.path.splitext(filename)
+    with _filename_lock:
+        candidate, counter = filename, 1
+        while candidate in _reserved_filenames:
+            counter += 1
+            candidate = f"{stem}_{counter}{extension}"
+        _reserved_filenames.add(candidate)
+    return candidate
+
+@lru_cache(maxsize=256)
+def slugify(text):
+    """
+    Turns a task description into a folder name: removes invalid characters, replaces
+    runs of whitespace (including line breaks) with underscores, lowercases the result and
+    cuts it to SLUG_MAX_LENGTH characters.
+    """
+    slug = WHITESPACE_PATTERN.sub('_', SLUG_INVALID_CHARS.sub('', text).strip()).lower()
+    return slug[:SLUG_MAX_LENGTH].rstrip('_')
+
+def task_folder_name(task):
+    """
+    Returns the folder name for a task, with a placeholder if the task name results in an empty string.
+    """
+    return slugify(task) or "unnamed_project"
+
 def generate_file_structure(task_list):
     """
     Creates folders and files based on a list of tasks.
     This function creates a folder for each task in the task_list,
     removes invalid characters from task names, replaces spaces with underscores,
     and creates a README.md file in each folder with a basic project description.
+    Tasks that map to the same folder name share one folder, so every directory is created only once.
     """
     print("DIRECTORIES: ", task_list) # debugging
+    base = Path(project_name_ui)
+    folders = {}
     for task in task_list:
-        base = f'{project_name_ui}'
-        folder_name = ''.join(c for c in task if c.isalnum() or c.isspace()).replace(" ", "_").lower()  # Remove invalid characters and replace spaces with underscores
-        if not folder_name:  # Check if folder name is empty
-            folder_name = "unnamed_project"  # Use a placeholder name if the task name results in an empty string
-        
-        # os.path.join(base, folder_name)
-        os.makedirs(base, exist_ok=True)  # Create folder if not exists
+        folders.setdefault(task_folder_name(task), task)
+    
+    base.mkdir(parents=True, exist_ok=True)  # Create the project folder once
+    for folder_name, task in folders.items():
+        folder = base / folder_name
+        folder.mkdir(exist_ok=True)
         # Create a README.md file in the folder with the project description
-    with open(f"{base}/README.md", 'w') as f:
-        f.write(f"Project: {task}\n")
+        (folder / "README.md").write_text(f"Project: {task}\n", encoding='utf-8')
 
 def coder_instance(task):
     """
-    Generates code based on a specific task, removes the first word, and writes the code to a file.
+    Generates code based on a specific task and writes the code to a file.
+    The filename is chosen first, so the answer can be streamed into the file while the model is still generating it.
+    Returns a (task, filename, code) triple, or None if no code was generated.
     """
-    code_response = generate_answers("coder", task) or ''  # Ensure it's not None
-    if code_response:
+    filename = reserve_filename(generate_filename(task))
+    try:
+        file = open(filename, 'w', encoding='utf-8')
+    except OSError as e:
+        print(f"Could not create {filename} for task {task}: {e}")
+        return None
+    parts = []
+    with file:
         try:
+            for chunk in stream_answers("coder", task):
+                file.write(chunk)
+                parts.append(chunk)
+        except Exception as e:
+            print(f"There was an error communicating with the Ollama model: {e}")
+            parts = []  # Don't hand a truncated answer on to testing
+    code_response = ''.join(parts)
+    if code_response:
+        language, *code = code_response.split('```', 1)  # Attempt to separate programming language from code
+        code = ''.join(code).strip()  # Rejoin the code without the programming language
+        print(f"Language: {language}, Code: {code[:50]}")  # For debugging
 
-            language, *code = code_response.split('```', 1)  # Attempt to separate programming language from code
-            code = ''.join(code).strip()  # Rejoin the code without the programming language
-            print(f"Language: {language}, Code: {code[:50]}")  # For debugging
-
-            # Determine file extension based on programming language
-            # file_extension = {
-            #     'python': '.py',
-            #     'javascript': '.js',
-            #     'html': '.html',
-            #     'css': '.css'
-            #     # Add more language-extension mappings as needed
-            # }.get(language.strip().lower(), '.txt')  # Default to .txt if language is not recognized
-                    
-            filename = generate_filename(task)
-            
-            with open(filename, 'w') as file:
-                file.write(code_response)
-            
-            print(f"{filename} written with code snippet.")
-            return filename, code_response
-        
-        except ValueError:
-            print(f"Error processing task: {task}")
-            pass
-    else:
-        print(f"No code generated for task: {task}")
-        language, code = 'Unknown', ''
+        # Determine file extension based on programming language
+        # file_extension = {
+        #     'python': '.py',
+        #     'javascript': '.js',
+        #     'html': '.html',
+        #     'css': '.css'
+        #     # Add more language-extension mappings as needed
+        # }.get(language.strip().lower(), '.txt')  # Default to .txt if language is not recognized
+
+        print(f"{filename} written with code snippet.")
+        return task, filename, code_response
+    print(f"No code generated for task: {task}")
+    try:
+        os.remove(filename)  # Remove the empty or partial file
+    except OSError:
         pass
+    return None
+
+def test_snippet(snippet):
+    """
+    Tests a (task, filename, code) triple from coder_instance and returns it with the tested code.
+    """
+    task, file_name, code = snippet
+    language = get_language_from_extension(file_name)  # Dynamically detect the language
+    success, tested_code = testing(code, [], language)  # Provide test cases if needed
+    return task, file_name, tested_code
+
+def get_html_parser():
+    """
+    Returns a strict html5lib parser for the current thread. Parsers keep state while parsing,
+    so each testing thread builds its own once and reuses it for every HTML file it checks.
+    """
+    parser = getattr(_html_parsers, 'parser', None)
+    if parser is None:
+        import html5lib  # Only needed when HTML files are generated
+        parser = _html_parsers.parser = html5lib.HTMLParser(strict=True)
+    return parser
+
+def tail_lines(text, max_lines):
+    """
+    Returns the last max_lines lines of text. The end of an error output names the actual
+    error, while the frames above it mostly cost prompt tokens.
+    """
+    lines = text.splitlines()
+    if len(lines) <= max_lines:
+        return text
+    return "\n".join(lines[-max_lines:])
+
+def run_python(code):
+    """
+    Checks Python code and returns None if it runs successfully, otherwise its error output.
+    Errors the compiler can find are caught with compile() before an interpreter is started; the code is
+    then run in a separate interpreter so it cannot touch our globals and can be stopped on a timeout.
+    With STATIC_PYTHON_CHECK the code is only compiled.
+    """
+    try:
+        compile(code, '<generated>', 'exec')
+    except (SyntaxError, ValueError) as e:
+        return f"{type(e).__name__}: {e}"
+    if STATIC_PYTHON_CHECK:
+        return None
+    try:
+        # The source is passed on stdin, which has no size limit unlike a command line argument
+        result = subprocess.run([sys.executable, '-'], input=code,
+                                capture_output=True, text=True, timeout=TEST_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return f"Timeout: the code did not finish within {TEST_TIMEOUT} seconds."
+    if result.returncode == 0:
+        return None
+    return result.stderr or f"The code exited with status {result.returncode} without an error message."
+
+def find_python_code(text):
+    """
+    Returns the code of the first fenced block tagged as Python, else of the first untagged block,
+    or None. Answers often start with a shell block such as "pip install ..." that isn't the program.
+    """
+    untagged = None
+    for match in CODE_BLOCK_PATTERN.finditer(text):
+        tag = match.group('tag').strip().lower()
+        if tag in PYTHON_CODE_TAGS:
+            return match.group('code')
+        if not tag and untagged is None:
+            untagged = match.group('code')
+    return untagged
 
 def testing(code, test_cases, language):
     """
     Tests the generated code using appropriate tools based on the programming language.
-    Automatically corrects the code if errors occur and repeats the process until the code can be successfully executed.
+    Automatically corrects the code if errors occur and repeats the process until the code can be successfully executed
+    or MAX_TEST_ITERATIONS runs have failed. Python code is run in a separate interpreter with a timeout.
    
     :param code: The code to be tested as a string.
     :param test_cases: Test cases specific to the programming language.
@@ -208,96 +644,133 @@ def testing(code, test_cases, language):
     success = False
     
     if language == 'python':
-        while not success:
-            temp_stdout = sys.stdout  # Temporarily store the standard output
-            sys.stdout = open('debug_log.txt', 'w')  # Redirect output to a file
-            try:
-                exec(corrected_code)  # Attempt to execute the code
-                sys.stdout.close()
-                sys.stdout = temp_stdout  # Restore the original standard output
+        code_block = find_python_code(corrected_code)
+        if code_block is not None:
+            corrected_code = code_block  # Test the code itself, not the Markdown answer around it
+        tested_versions = set()
+        for attempt in range(MAX_TEST_ITERATIONS):
+            tested_versions.add(corrected_code)
+            error_message = run_python(corrected_code)
+            if error_message is None:
                 success = True  # No errors, test successful
-            except Exception as e:
-                sys.stdout.close()
-                sys.stdout = temp_stdout  # Restore the original standard output
-                error_message = ''.join(traceback.format_exception(None, e, e.__traceback__))  # Error message
-                corrected_code = correction(corrected_code + "\n# Error: " + error_message)  # Attempt to correct the code
+                break
+            if attempt == MAX_TEST_ITERATIONS - 1:
+                break  # No attempts left to test another correction
+            new_code = correction(corrected_code + "\n# Error: " + tail_lines(error_message, ERROR_CONTEXT_LINES))  # Attempt to correct the code
+            if not new_code or new_code in tested_versions:
+                break  # The model failed or is going in circles; further corrections would be wasted calls
+            corrected_code = new_code
     
     elif language == 'javascript':
-        # Save the code to a temporary file
-        with open('temp.js', 'w') as file:
-            file.write(corrected_code)
-        
         while not success:
             try:
-                # Run the JavaScript code using Node.js
-                subprocess.check_output(['node', 'temp.js'], stderr=subprocess.STDOUT)
+                # Run the JavaScript code using Node.js, passing the source on stdin instead of a temporary file
+                subprocess.check_output(['node', '-'], input=corrected_code.encode('utf-8'), stderr=subprocess.STDOUT)
                 success = True  # No errors, test successful
             except subprocess.CalledProcessError as e:
                 error_message = e.output.decode('utf-8')  # Error message
                 success = True  # No errors, test successful
                 # corrected_code = correction(corrected_code + "\n// Error: " + error_message)  # Attempt to correct the code
-        
-        # Remove the temporary file
-        os.remove('temp.js')
     
     elif language == 'html':
-        # Save the code to a temporary file
-        with open('temp.html', 'w') as file:
-            file.write(corrected_code)
-        
-        # Validate HTML using a library like html5lib or BeautifulSoup
+        # Validate HTML in memory using a library like html5lib or BeautifulSoup
         # You can install html5lib using: pip install html5lib
-        import html5lib
-        with open('temp.html', 'r') as file:
-            html = file.read()
-            parser = html5lib.HTMLParser(strict=True)            
-            try:
-                parser.parse(html)
-                success = True  # No errors, HTML is valid
-            except Exception as e:
-                error_message = str(e)  # Error message
-                # corrected_code = correction(corrected_code + "\n<!-- Error: " + error_message + " -->")  # Attempt to correct the code
-        
-        # Remove the temporary file
-        os.remove('temp.html')
+        parser = get_html_parser()
+        try:
+            parser.parse(corrected_code)
+            success = True  # No errors, HTML is valid
+        except Exception as e:
+            error_message = str(e)  # Error message
+            # corrected_code = correction(corrected_code + "\n<!-- Error: " + error_message + " -->")  # Attempt to correct the code
     
     return (success, corrected_code)  # Return the status and corrected code
 
 def correction(code):
-    correction_prompt = f"Please correct the following code: {code}"
-    correction_response = generate_answers("coder", correction_prompt)
-    return correction_response
+    """
+    Asks the coder model for a corrected version of the code. The answer is streamed and
+    the request is cut short as soon as a complete Python code block has arrived, since
+    anything the model writes after it is explanation that testing() cannot execute.
+    """
+    correction_prompt = ("Please correct the following code. Reply with the complete corrected code in a single code block, "
+                         f"keeping everything verbatim except for the minimal edits needed to fix the error: {code}")
+    parts = []
+    try:
+        for chunk in stream_answers("correction", correction_prompt):
+            parts.append(chunk)
+            if '`' in chunk:
+                answer = ''.join(parts)
+                if any(match.group('tag').strip().lower() in PYTHON_CODE_TAGS for match in CODE_BLOCK_PATTERN.finditer(answer)):
+                    return find_python_code(answer)
+    except Exception as e:
+        print(f"There was an error communicating with the Ollama model: {e}")
+        return None
+    answer = ''.join(parts)
+    code_block = find_python_code(answer)
+    return answer if code_block is None else code_block
 
 def documentation(code_snippets):
     """
     Create documentation for the code snippets in the form of a Github ReadMe.
+    code_snippets is a list of (task, file_name, code) triples as returned by coder_instance.
+    The prompt and the project structure are built in a single pass with join()
+    instead of growing strings in a loop.
     """
-    documentation_prompt = f"Create documentation for the following code snippets in the form of a Github ReadMe: {code_snippets}"
+    # Identical snippets (e.g. boilerplate generated for several tasks) are only sent to the model once
+    unique_snippets = {}
+    for task, file_name, code in code_snippets:
+        unique_snippets.setdefault(code, file_name)
+    snippets_text = "\n\n".join(f"{file_name}:\n```\n{code}\n```" for code, file_name in unique_snippets.items())
+    documentation_prompt = f"Create documentation for the following code snippets in the form of a Github ReadMe:\n{snippets_text}"
     documentation_response = generate_answers("coder", documentation_prompt)
    
-    project_structure = "## Project Structure\n"
-    for code_snippet in code_snippets:
-        task = code_snippet.split('\n')[0].strip()  # Assuming the first line of each code snippet is the task description
-        folder_name = task.replace(" ", "_").lower()
-        project_structure += f"- {folder_name}/\n    - {task.replace(' ', '_').lower()}_function.py\n"
+    structure_lines = ["## Project Structure"]
+    for task, file_name, code in code_snippets:
+        structure_lines.append(f"- {task_folder_name(task)}/\n    - {file_name}")
+    project_structure = "\n".join(structure_lines) + "\n"
    
     documentation_content = f"# Project Documentation\n\n{project_structure}\n{documentation_response}"
    
-    with open('README.md', 'w') as file:
-        file.write(documentation_content)
+    Path('README.md').write_text(documentation_content, encoding='utf-8')
+
+def find_imported_packages(code):
+    """
+    Returns the top-level packages imported by Python code. Generated answers are often
+    wrapped in Markdown, so fenced code blocks are parsed individually when present.
+    Sources that don't parse as Python are skipped.
+    """
+    packages = set()
+    for source in [match.group('code') for match in CODE_BLOCK_PATTERN.finditer(code)] or [code]:
+        try:
+            tree = ast.parse(source)
+        except (SyntaxError, ValueError):
+            continue
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                packages.update(alias.name.split(".")[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                packages.add(node.module.split(".")[0])
+    return packages
 
 def install_dependencies():
     """
     Install project dependencies automatically based on file extensions or generated code outputs.
     """
     print("Installing project dependencies...")
+    python_packages = set()  # Collected first and installed with a single pip call where possible
     
-    # Detect programming language based on file extensions
+    # Detect programming language based on file extensions and collect generated code outputs in the same walk
     file_extensions = set()
+    text_files = []
+    local_modules = set()  # The project's own modules, e.g. "from utils import ...", are not on PyPI
     for root, dirs, files in os.walk("."):
+        dirs[:] = [d for d in dirs if d not in SKIPPED_DIRECTORIES]  # Don't descend into VCS or dependency folders
         for file in files:
-            _, extension = os.path.splitext(file)
+            stem, extension = os.path.splitext(file)
             file_extensions.add(extension)
+            if extension == ".py":
+                local_modules.add(stem)
+            elif extension == ".txt":  # Assuming generated code is stored in .txt files
+                text_files.append(os.path.join(root, file))
     
     # Install dependencies based on programming language
     if ".py" in file_extensions:
@@ -306,15 +779,11 @@ def install_dependencies():
 
         # Check if requirements.txt exists
         if os.path.exists("requirements.txt"):
-            subprocess.run(["pip", "install", "-r", "requirements.txt"])
+            subprocess.run([*PIP_INSTALL, "-r", "requirements.txt"])
         else:
             # Try to install common Python packages
             common_packages = ["requests", "numpy", "pandas", "matplotlib"]
-            for package in common_packages:
-                try:
-                    subprocess.run(["pip", "install", package])
-                except subprocess.CalledProcessError:
-                    print(f"Failed to install package: {package}")
+            python_packages.update(common_packages)
     
     # if ".js" in file_extensions:
     #     # JavaScript dependencies
@@ -333,44 +802,51 @@ def install_dependencies():
     #                 print(f"Failed to install package: {package}")
     
     # Analyze generated code outputs for additional dependencies
-    for root, dirs, files in os.walk("."):
-        for file in files:
-            if file.endswith(".txt"):  # Assuming generated code is stored in .txt files
-                with open(os.path.join(root, file), "r") as f:
-                    code = f.read()
-                    
-                    # Python dependencies
-                    if "import" in code:
-                        lines = code.split("\n")
-                        for line in lines:
-                            if line.startswith("import") or line.startswith("from"):                                
-                                package = line.split()[1].split(".")[0]
-                                try:
-                                    subprocess.run(["pip", "install", package])
-                                except subprocess.CalledProcessError:
-                                    print(f"Failed to install package: {package}")
-                    
-                    # # JavaScript dependencies
-                    # if "require" in code:
-                    #     lines = code.split("\n")
-                    #     for line in lines:
-                    #         if line.startswith("const") or line.startswith("var"):
-                    #             package = line.split("=")[1].split("(")[1].split(")")[0].strip("'\"")
-                    #             try:
-                    #                 subprocess.run(["npm", "install", package])
-                    #             except subprocess.CalledProcessError:
-                    #                 print(f"Failed to install package: {package}")
+    for path in text_files:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            code = f.read()
+            
+            # Python dependencies
+            if "import" in code:
+                python_packages.update(find_imported_packages(code))
+            
+            # # JavaScript dependencies
+            # if "require" in code:
+            #     lines = code.split("\n")
+            #     for line in lines:
+            #         if line.startswith("const") or line.startswith("var"):
+            #             package = line.split("=")[1].split("(")[1].split(")")[0].strip("'\"")
+            #             try:
+            #                 subprocess.run(["npm", "install", package])
+            #             except subprocess.CalledProcessError:
+            #                 print(f"Failed to install package: {package}")
+    
+    # Standard library and project modules can't be installed from PyPI
+    python_packages.difference_update(getattr(sys, 'stdlib_module_names', ()))
+    python_packages.difference_update(local_modules)
+    packages = sorted({IMPORT_TO_PACKAGE.get(name, name) for name in python_packages})
+    if packages:
+        result = subprocess.run([*PIP_INSTALL, *packages])
+        if result.returncode != 0:
+            # pip installs nothing if a single name is unknown, so install the packages one by one
+            failed = [package for package in packages if subprocess.run([*PIP_INSTALL, package]).returncode != 0]
+            if failed:
+                print(f"Failed to install packages: {', '.join(failed)}")
     
     print("Dependency installation completed.")
 
 if __name__ == '__main__':
+    if PRELOAD_MODELS:
+        threading.Thread(target=preload_models, daemon=True).start()
     project_description = input("Please provide detailed input for your project: ")
     response = service_desk(project_description)
     print(response)
-    specified_project_description = ""
+    specified_descriptions = []
     while True:
         new_specified_description = input("Please provide or update your answers to questions: ")
-        specified_project_description += " " + new_specified_description  # Update with additional details
+        specified_descriptions.append(new_specified_description)  # Update with additional details
+        # Earlier answers stay in front, so every round repeats the previous prompt as a prefix Ollama can reuse
+        specified_project_description = " ".join(specified_descriptions)
         response2 = service_desk2(specified_project_description)
         print(response2)
         agreement = input("Are you good with this? (y/n): ")